@@ -1,6 +1,9 @@
+import logging
+import asyncio
 from json import load
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 
 from sqlalchemy import create_engine
@@ -10,7 +13,9 @@ from models import (
     Item,
     Order, 
     OrderItem,
-    Employee
+    Employee,
+    MediaFile,
+    Location
 )
 
 from utils import (
@@ -19,17 +24,49 @@ from utils import (
     ReplyGenerator, 
     ItemPaginator,
     SyncOrder,
-    language_converter
+    ConversationTracker,
+    CartStorage,
+    UpdateRecorder,
+    MediaCache,
+    LocationRegistry,
+    deep_sizeof
 )
 
 
+logger = logging.getLogger(__name__)
+
 with open('tokens.json', 'r') as f:
-    db_token = load(f)["db-token"]
+    config = load(f)
+
+db_token = config["db-token"]
     
 engine = create_engine(db_token)
 
 START, MENU, ITEMS, ORDER = range(4)
 
+CONVERSATION_TIMEOUT = config.get("conversation-timeout", 30 * 60)
+MAX_CONVERSATIONS = config.get("max-conversations", 1000)
+ADMIN_IDS = config.get("admin-ids", [])
+CAPTION_LIMIT = 1024
+CART_KEYS = ("qrcode_id", "location_id", "total_price", "current_order", "language")
+CAPTURE_PATH = config.get("capture-path")
+
+locations = LocationRegistry(engine=engine, location_model=Location, item_model=Item, qrcode_model=QRCode, catalog_ttl=config.get("catalog-ttl", 60))
+tracker = ConversationTracker(max_conversations=MAX_CONVERSATIONS)
+media_cache = MediaCache(engine=engine, media_model=MediaFile, path=config.get("thumbnails-path", "thumbnails"))
+cart_storage = None
+recorder = None
+
+
+def open_storage() -> None:
+    global cart_storage, recorder
+    
+    # файлы создаются только при запуске бота, импорт модуля (например, из replay.py) их не трогает
+    if config.get("cart-storage"):
+        cart_storage = CartStorage(path=config["cart-storage"])
+    if CAPTURE_PATH:
+        recorder = UpdateRecorder(path=CAPTURE_PATH, salt=config["capture-salt"])
+
 
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
     try:
@@ -52,6 +89,7 @@ async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
     
     user_data = ctx.user_data
     user_data["qrcode_id"] = qrcode.id
+    user_data["location_id"] = qrcode.location_id
     user_data["total_price"] = 0
     user_data["current_order"] = []
     user_data["reply_generator"] = None
@@ -79,13 +117,12 @@ async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def menu(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
     user_data = ctx.user_data
-    callback_text = update.message.text
     
     if not user_data["reply_generator"]:
-        language = language_converter(text=callback_text)
+        language = user_data.get("language")
         if language:
             user_data["reply_generator"] = ReplyGenerator(language=language)
-            user_data["item_paginator"] = ItemPaginator(engine=engine, item_model=Item, language=language)
+            user_data["item_paginator"] = ItemPaginator(catalog=locations.catalog(user_data.get("location_id")), language=language)
         else:
             await update.message.reply_text(
                 text="That don't works this way."
@@ -124,9 +161,9 @@ async def item_view(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
     user_data = ctx.user_data
     reply_generator = user_data["reply_generator"]
     
-    getter = ItemGetter(engine=engine, item_model=Item)
+    catalog = locations.catalog(user_data.get("location_id"))
     
-    item = getter.get_item(attribute="name", value=update.message.text)
+    item = catalog.get_item(attribute="name", value=update.message.text)
     
     if not item:
         await update.message.reply_text(
@@ -136,12 +173,56 @@ async def item_view(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
 
     text, reply_markup = reply_generator.item_view_reply(item=item)
 
+    if item.image:
+        # подпись к фото короче обычного сообщения, длинный текст уходит отдельно
+        caption_fits = len(text) <= CAPTION_LIMIT
+        
+        try:
+            await _reply_photo(
+                update=update,
+                image=item.image,
+                caption=text if caption_fits else None,
+                reply_markup=reply_markup if caption_fits else None
+            )
+            if caption_fits:
+                return
+        except OSError as error:
+            logger.warning("Can't send image %s of item %s: %s", item.image, item.id, error)
+
     await update.message.reply_text(
         text=text,
         reply_markup=reply_markup
     )
 
 
+async def _reply_photo(update: Update, image: str, caption: str | None, reply_markup) -> None:
+    content_hash = await media_cache.content_hash(image)
+    file_id = media_cache.get_file_id(content_hash)
+    
+    if file_id:
+        try:
+            await update.message.reply_photo(
+                photo=file_id,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+            return
+        except BadRequest as error:
+            if "file identifier" not in error.message.lower():
+                raise
+            media_cache.forget(content_hash)
+    
+    thumbnail = await media_cache.thumbnail(image)
+    
+    message = await update.message.reply_photo(
+        photo=thumbnail,
+        caption=caption,
+        reply_markup=reply_markup
+    )
+    
+    media_cache.save_file_id(content_hash, message.photo[-1].file_id)
+
+
 async def item_view_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
     user_data = ctx.user_data
     reply_generator = user_data["reply_generator"]
@@ -149,15 +230,21 @@ async def item_view_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> N
     
     await query.answer()
     
-    getter = ItemGetter(engine=engine, item_model=Item)
+    catalog = locations.catalog(user_data.get("location_id"))
     
-    item = getter.get_item(attribute="id", value=query.data)
+    item = catalog.get_item(attribute="id", value=query.data)
     
     user_data["current_order"].append(item.id)
     user_data["total_price"] += item.price
     
     text = reply_generator.item_view_handler_reply(item_name=item.name)
     
+    if query.message.photo:
+        await query.edit_message_caption(
+            caption=text
+        )
+        return
+    
     await query.edit_message_text(
         text=text
     )
@@ -166,10 +253,10 @@ async def item_view_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> N
 async def order_list(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
     user_data = ctx.user_data
     reply_generator = user_data["reply_generator"]
+    catalog = locations.catalog(user_data.get("location_id"))
     
     for item_id in user_data["current_order"]:
-        getter = ItemGetter(engine=engine, item_model=Item)
-        item = getter.get_item(attribute="id", value=item_id)
+        item = catalog.get_item(attribute="id", value=item_id)
         
         text, reply_markup = reply_generator.order_item_reply(
             item_id=item_id,
@@ -203,8 +290,8 @@ async def order_list_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE) ->
     item_id = query.data
     user_data["current_order"].remove(int(item_id))
     
-    getter = ItemGetter(engine=engine, item_model=Item)
-    item = getter.get_item(attribute="id", value=item_id)
+    catalog = locations.catalog(user_data.get("location_id"))
+    item = catalog.get_item(attribute="id", value=item_id)
     
     user_data["total_price"] -= item.price
 
@@ -214,7 +301,9 @@ async def order_list_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE) ->
         text=query_text
     )
 
-    await user_data["order_message"].delete()
+    order_message = user_data.get("order_message")
+    if order_message:
+        await order_message.delete()
     
     user_data["order_message"] = await ctx.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -235,19 +324,37 @@ async def checkout(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
         )
         
         user_data.clear()
+        tracker.forget(update.effective_user.id)
         
         return ConversationHandler.END
     
     
-    sync_order = SyncOrder(
-        engine=engine,
-        order_model=Order,
-        order_item_model=OrderItem,
-        employee_model=Employee,
-        total_price=user_data["total_price"],
-        qrcode_id=user_data["qrcode_id"],
-        current_order=user_data["current_order"]
-    )
+    locations.copy_qrcode(location_id=user_data.get("location_id"), qrcode_id=user_data["qrcode_id"])
+    
+    try:
+        sync_order = SyncOrder(
+            engine=locations.engine(user_data.get("location_id")),
+            order_model=Order,
+            order_item_model=OrderItem,
+            employee_model=Employee,
+            total_price=user_data["total_price"],
+            qrcode_id=user_data["qrcode_id"],
+            current_order=user_data["current_order"],
+            location_id=user_data.get("location_id")
+        )
+    except LookupError as error:
+        # у локации нет сотрудников в её базе, заказ некому назначить
+        logger.error("Can't place order for qrcode %s: %s", user_data["qrcode_id"], error)
+        
+        await update.message.reply_text(
+            text="Sorry, the order can't be placed right now. Please ask the staff for help.",
+            reply_markup=reply_markup
+        )
+        
+        user_data.clear()
+        tracker.forget(update.effective_user.id)
+        
+        return ConversationHandler.END
     
     sync_order.commit()
         
@@ -257,5 +364,139 @@ async def checkout(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int:
     )
 
     user_data.clear()
+    tracker.forget(update.effective_user.id)
+
+    return ConversationHandler.END
+
+
+def _restore(user_id: int, user_data: dict) -> None:
+    if "qrcode_id" not in user_data and cart_storage:
+        cart = cart_storage.load(user_id)
+        if cart:
+            user_data.update(cart)
+            user_data.setdefault("reply_generator", None)
+            user_data.setdefault("item_paginator", None)
+    
+    language = user_data.get("language")
+    
+    if language and not user_data.get("reply_generator"):
+        user_data["reply_generator"] = ReplyGenerator(language=language)
+        user_data["item_paginator"] = ItemPaginator(catalog=locations.catalog(user_data.get("location_id")), language=language)
+
+
+def _evict(app, user_id: int) -> None:
+    user_data = app.user_data.get(user_id)
+    
+    if not user_data:
+        return
+    
+    if cart_storage and "qrcode_id" in user_data:
+        cart_storage.save(user_id, {key: user_data[key] for key in CART_KEYS if key in user_data})
+        app.drop_user_data(user_id)
+        return
+    
+    user_data["reply_generator"] = None
+    user_data["item_paginator"] = None
+    user_data.pop("order_message", None)
+
 
-    return ConversationHandler.END
\ No newline at end of file
+async def track_activity(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    user = update.effective_user
+    
+    if not user:
+        return
+    
+    _restore(user_id=user.id, user_data=ctx.user_data)
+    
+    # вне разговора пользователь не занимает место в LRU
+    if "qrcode_id" not in ctx.user_data:
+        return
+    
+    for user_id in tracker.touch(user.id):
+        _evict(app=ctx.application, user_id=user_id)
+
+
+async def timeout(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    ctx.user_data.clear()
+    tracker.forget(update.effective_user.id)
+    
+    if cart_storage:
+        cart_storage.delete(update.effective_user.id)
+
+
+async def memory_stats(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    conversations = {user_id: data for user_id, data in ctx.application.user_data.items() if data}
+    
+    entries = []
+    total = 0
+    
+    for user_id, data in conversations.items():
+        for key, value in data.items():
+            size = deep_sizeof(value)
+            entries.append((size, user_id, key))
+            total += size
+    
+    average = total // len(conversations) if conversations else 0
+    
+    lines = [
+        f"Conversations: {len(conversations)}",
+        f"Tracked users: {len(tracker)}",
+        f"Approx. bytes total: {total}",
+        f"Approx. bytes per conversation: {average}",
+        "Largest entries:"
+    ]
+    
+    for size, user_id, key in sorted(entries, reverse=True)[:10]:
+        idle = tracker.idle(user_id)
+        idle_text = f", idle {int(idle)}s" if idle is not None else ""
+        lines.append(f"{user_id} {key}: {size} bytes{idle_text}")
+    
+    await update.message.reply_text(
+        text="\n".join(lines)
+    )
+
+
+async def capture(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    recorder.record(update.to_dict())
+
+
+async def close_capture(app) -> None:
+    if recorder:
+        recorder.close()
+
+
+async def _prepare_thumbnail(item) -> None:
+    try:
+        await media_cache.thumbnail(item.image)
+    except OSError as error:
+        logger.warning("Can't prepare image %s of item %s: %s", item.image, item.id, error)
+
+
+async def _prepare_thumbnails(ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    items = [
+        item
+        for location_id in [None] + locations.location_ids()
+        for item in locations.catalog(location_id).items
+        if item.image
+    ]
+    
+    await asyncio.gather(*(_prepare_thumbnail(item) for item in items))
+
+
+async def prepare_media(app) -> None:
+    # миниатюры готовятся в фоне после запуска, бот начинает отвечать не дожидаясь их
+    app.job_queue.run_once(_prepare_thumbnails, when=0, name="prepare-media")
+
+
+async def refresh_locations(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    locations.refresh()
+    
+    await update.message.reply_text(
+        text="Locations and catalogs reloaded."
+    )
\ No newline at end of file
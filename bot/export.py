@@ -0,0 +1,281 @@
+import os
+import csv
+from io import StringIO, BytesIO
+from json import load, dump
+from itertools import islice
+from argparse import ArgumentParser, ArgumentTypeError
+from typing import Iterator, Literal
+
+from fastapi import FastAPI, Query
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from models import Order, OrderItem, Item
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+with open('tokens.json', 'r') as f:
+    db_token = load(f)["db-token"]
+
+# отдельный движок без пула, чтобы выгрузка не занимала соединения бота
+engine = create_engine(db_token, poolclass=NullPool)
+
+COLUMNS = [
+    "order_id",
+    "total_price",
+    "qrcode_id",
+    "employee_id",
+    "order_item_id",
+    "item_id",
+    "item_name",
+    "item_price"
+]
+
+if pa is not None:
+    SCHEMA = pa.schema([
+        ("order_id", pa.int64()),
+        ("total_price", pa.int64()),
+        ("qrcode_id", pa.int64()),
+        ("employee_id", pa.int64()),
+        ("order_item_id", pa.int64()),
+        ("item_id", pa.int64()),
+        ("item_name", pa.string()),
+        ("item_price", pa.int64())
+    ])
+
+
+class OrderExporter:
+    def __init__(self,
+                 engine,
+                 batch_size: int = 10000,
+                 min_order_id: int | None = None,
+                 max_order_id: int | None = None,
+                 after: int | None = None
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+
+        self._engine = engine
+        self._batch_size = batch_size
+        self._min_order_id = min_order_id
+        self._max_order_id = max_order_id
+        self._after = after
+
+    @property
+    def checkpoint(self) -> int | None:
+        return self._after
+
+    def _get_query(self, session: Session):
+        query = session.query(
+            Order.id,
+            Order.total_price,
+            Order.qrcode_id,
+            Order.employee_id,
+            OrderItem.id,
+            Item.id,
+            Item.name,
+            Item.price
+        ).join(
+            OrderItem, OrderItem.order_id == Order.id
+        ).join(
+            Item, Item.id == OrderItem.item_id
+        )
+
+        if self._min_order_id is not None:
+            query = query.filter(Order.id >= self._min_order_id)
+        if self._max_order_id is not None:
+            query = query.filter(Order.id <= self._max_order_id)
+        if self._after is not None:
+            query = query.filter(OrderItem.id > self._after)
+
+        return query.order_by(OrderItem.id).yield_per(self._batch_size)
+
+    def batches(self) -> Iterator[list]:
+        with Session(self._engine) as session:
+            rows = iter(self._get_query(session))
+
+            while True:
+                batch = [tuple(row) for row in islice(rows, self._batch_size)]
+                if not batch:
+                    break
+
+                # контрольная точка сдвигается до того, как пачку отдадут на запись
+                self._after = batch[-1][4]
+                yield batch
+
+    def csv_chunks(self, header: bool = True) -> Iterator[str]:
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+
+        # заголовок отдаётся сразу, чтобы и пустая выборка была корректным csv
+        if header:
+            writer.writerow(COLUMNS)
+            yield buffer.getvalue()
+
+            buffer.seek(0)
+            buffer.truncate()
+
+        for batch in self.batches():
+            writer.writerows(batch)
+            yield buffer.getvalue()
+
+            buffer.seek(0)
+            buffer.truncate()
+
+    def record_batches(self) -> Iterator:
+        if pa is None:
+            raise RuntimeError("pyarrow is required for columnar export.")
+
+        for batch in self.batches():
+            columns = list(zip(*batch))
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)]
+            yield pa.record_batch(arrays, schema=SCHEMA)
+
+    def arrow_chunks(self) -> Iterator[bytes]:
+        if pa is None:
+            raise RuntimeError("pyarrow is required for columnar export.")
+
+        sink = BytesIO()
+        # схема пишется сразу, пустая выборка тоже читается как поток arrow
+        writer = pa.ipc.new_stream(sink, SCHEMA)
+
+        try:
+            for record_batch in self.record_batches():
+                writer.write_batch(record_batch)
+
+                yield sink.getvalue()
+
+                sink.seek(0)
+                sink.truncate()
+        finally:
+            writer.close()
+
+        yield sink.getvalue()
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+
+    if number < 1:
+        raise ArgumentTypeError(f"{value} is not a positive integer")
+
+    return number
+
+
+def _load_checkpoint(path: str) -> int | None:
+    try:
+        with open(path, 'r') as f:
+            return load(f)["after"]
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(path: str, after: int | None) -> None:
+    with open(path, 'w') as f:
+        dump({"after": after}, f)
+
+
+def export(exporter: OrderExporter, output: str, file_format: str, checkpoint: str | None) -> None:
+    if file_format == "csv":
+        # при продолжении с контрольной точки дописываем в тот же файл без заголовка
+        resume = exporter.checkpoint is not None
+
+        with open(output, 'a' if resume else 'w', newline='') as f:
+            for chunk in exporter.csv_chunks(header=not resume):
+                f.write(chunk)
+                f.flush()
+
+                # заголовок ещё не сдвигает контрольную точку
+                if checkpoint and exporter.checkpoint is not None:
+                    _save_checkpoint(checkpoint, exporter.checkpoint)
+        return
+
+    # parquet и arrow нельзя дописать, продолжение пишется только в новый файл
+    if exporter.checkpoint is not None and os.path.exists(output):
+        raise FileExistsError(f"{output} already exists, resume {file_format} export into a new file.")
+
+    if pa is None:
+        raise RuntimeError("pyarrow is required for columnar export.")
+
+    # файл создаётся сразу, пустая выгрузка даёт файл только со схемой
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(output, SCHEMA)
+    else:
+        writer = pa.ipc.new_file(output, SCHEMA)
+
+    try:
+        for record_batch in exporter.record_batches():
+            if file_format == "parquet":
+                writer.write_table(pa.Table.from_batches([record_batch]))
+            else:
+                writer.write_batch(record_batch)
+
+            if checkpoint:
+                _save_checkpoint(checkpoint, exporter.checkpoint)
+    finally:
+        writer.close()
+
+
+app = FastAPI()
+
+
+@app.get("/export/orders")
+def export_orders(file_format: Literal["csv", "arrow"] = "csv",
+                  batch_size: int = Query(10000, gt=0),
+                  min_order_id: int | None = None,
+                  max_order_id: int | None = None,
+                  after: int | None = None):
+    exporter = OrderExporter(
+        engine=engine,
+        batch_size=batch_size,
+        min_order_id=min_order_id,
+        max_order_id=max_order_id,
+        after=after
+    )
+
+    if file_format == "arrow":
+        return StreamingResponse(exporter.arrow_chunks(), media_type="application/vnd.apache.arrow.stream")
+
+    return StreamingResponse(exporter.csv_chunks(header=after is None), media_type="text/csv")
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Streaming export of orders joined with their items.")
+    parser.add_argument("output", help="path to the output file (csv is appended to on resume, parquet/arrow need a new file)")
+    parser.add_argument("--format", dest="file_format", choices=["csv", "parquet", "arrow"], default="csv")
+    parser.add_argument("--batch-size", type=_positive_int, default=10000)
+    parser.add_argument("--min-order-id", type=int)
+    parser.add_argument("--max-order-id", type=int)
+    parser.add_argument("--after", type=int, help="last exported order-item id")
+    parser.add_argument("--checkpoint", help="file to store and resume the last exported order-item id")
+    args = parser.parse_args()
+
+    after = args.after
+    if after is None and args.checkpoint:
+        after = _load_checkpoint(args.checkpoint)
+
+    exporter = OrderExporter(
+        engine=engine,
+        batch_size=args.batch_size,
+        min_order_id=args.min_order_id,
+        max_order_id=args.max_order_id,
+        after=after
+    )
+
+    try:
+        export(exporter=exporter, output=args.output, file_format=args.file_format, checkpoint=args.checkpoint)
+    except FileExistsError as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 import logging
 from json import load
 
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters
 )
 
@@ -15,6 +17,8 @@ from commands import (
     MENU,
     ITEMS, 
     ORDER,
+    CONVERSATION_TIMEOUT,
+    CAPTURE_PATH,
     start,
     menu,
     items,
@@ -22,9 +26,19 @@ from commands import (
     order_list_handler,
     item_view,
     item_view_handler,
-    checkout
+    checkout,
+    track_activity,
+    timeout,
+    memory_stats,
+    capture,
+    close_capture,
+    prepare_media,
+    refresh_locations,
+    open_storage
 )
 
+from utils import TextRouter
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO
@@ -35,35 +49,61 @@ with open('tokens.json', 'r') as f:
     bot_token = load(f)["bot-token"]
 
 
-def main() -> None:
-    app = Application.builder().token(bot_token).build()
+def add_handlers(app: Application, record_updates: bool = True) -> None:
+    router = TextRouter(
+        states={
+            START: {"language": menu, "exit": checkout, "checkout": checkout},
+            MENU: {"items": items, "order": order_list, "exit": checkout, "checkout": checkout},
+            ITEMS: {"menu": menu, "prev": items, "next": items, "exit": checkout, "checkout": checkout},
+            ORDER: {"items": items, "exit": checkout, "checkout": checkout}
+        },
+        defaults={
+            ITEMS: item_view
+        }
+    )
+    
+    text_filter = filters.TEXT & ~filters.COMMAND
     
     conversation_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             START: [
-                MessageHandler(filters.Regex("^(English|Русский)$"), menu)
+                MessageHandler(text_filter, router.handler(START))
             ],
             MENU: [
-                MessageHandler(filters.Regex("^(Items to buy|Предметы для покупки)$"), items),
-                MessageHandler(filters.Regex("^(Current order|Текущий заказ)$"), order_list)
+                MessageHandler(text_filter, router.handler(MENU))
             ],
             ITEMS: [
-                MessageHandler(filters.Regex("^(Back to menu|Обратно в меню)$"), menu),
-                MessageHandler(filters.Regex("^<$"), items),
-                MessageHandler(filters.Regex("^>$"), items),
-                MessageHandler(filters.TEXT & ~(filters.COMMAND | filters.Regex("^(Exit|Checkout|Выход|Оплатить)$")), item_view),
+                MessageHandler(text_filter, router.handler(ITEMS)),
                 CallbackQueryHandler(item_view_handler)
             ],
             ORDER: [
-                MessageHandler(filters.Regex("^(Items to buy|Предметы для покупки)$"), items),
+                MessageHandler(text_filter, router.handler(ORDER)),
                 CallbackQueryHandler(order_list_handler)
+            ],
+            ConversationHandler.TIMEOUT: [
+                TypeHandler(Update, timeout)
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex("^(Exit|Checkout|Выход|Оплатить)$"), checkout)]
+        fallbacks=[],
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     
+    if CAPTURE_PATH and record_updates:
+        app.add_handler(TypeHandler(Update, capture), group=-2)
+    
+    app.add_handler(TypeHandler(Update, track_activity), group=-1)
+    app.add_handler(CommandHandler("memory", memory_stats))
+    app.add_handler(CommandHandler("refresh", refresh_locations))
     app.add_handler(conversation_handler)
+
+
+def main() -> None:
+    open_storage()
+    
+    app = Application.builder().token(bot_token).post_init(prepare_media).post_shutdown(close_capture).build()
+    
+    add_handlers(app)
     
     app.run_polling()
 
@@ -5,11 +5,20 @@ from sqlalchemy.orm import declarative_base
 Base = declarative_base()
 
 
+class Location(Base):
+    __tablename__ = "location"
+    
+    id = Column(BigInteger, primary_key=True)
+    name = Column(String, nullable=False)
+    db_token = Column(String)
+
+
 class QRCode(Base):
     __tablename__ = "qrcode"
     
     id = Column(BigInteger, primary_key=True)
     uuid = Column(String, nullable=False)
+    location_id = Column(BigInteger, ForeignKey("location.id"))
 
 
 class Role(Base):
@@ -46,6 +55,7 @@ class Employee(Base):
     salary = Column(REAL, nullable=False)
     order_count = Column(Integer, nullable=False)
     user_id = Column(BigInteger, ForeignKey("user.id"), nullable=False)
+    location_id = Column(BigInteger, ForeignKey("location.id"))
 
     
 class Item(Base):
@@ -55,6 +65,8 @@ class Item(Base):
     name = Column(String, nullable=False)
     description = Column(String, nullable=False)
     price = Column(Integer, nullable=False)
+    image = Column(String)
+    location_id = Column(BigInteger, ForeignKey("location.id"))
 
 
 class Order(Base):
@@ -72,4 +84,11 @@ class OrderItem(Base):
     
     id = Column(BigInteger, primary_key=True)
     order_id = Column(BigInteger, ForeignKey("order.id"), nullable=False)
-    item_id = Column(BigInteger, ForeignKey("item.id"), nullable=False)
\ No newline at end of file
+    item_id = Column(BigInteger, ForeignKey("item.id"), nullable=False)
+
+
+class MediaFile(Base):
+    __tablename__ = "media-file"
+    
+    content_hash = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
\ No newline at end of file
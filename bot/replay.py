@@ -0,0 +1,269 @@
+import sys
+import zlib
+import gzip
+import logging
+import asyncio
+import tempfile
+from json import loads, dumps, load, dump, JSONDecodeError
+from time import perf_counter, time
+from statistics import mean, quantiles
+from argparse import ArgumentParser
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import utils
+import commands
+from main import add_handlers
+from models import Base, QRCode, Item, Employee, MediaFile, Location
+
+
+class FakeRequest(BaseRequest):
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+        self._message_id: int = 0
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, parameters: dict, photo: bool) -> dict:
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time()),
+            "chat": {"id": parameters.get("chat_id", 0), "type": "private"}
+        }
+
+        if photo:
+            message["caption"] = parameters.get("caption")
+            message["photo"] = [{"file_id": f"replay-{self._message_id}", "file_unique_id": f"replay-{self._message_id}", "width": 1, "height": 1}]
+        else:
+            message["text"] = parameters.get("text", "")
+
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "replay", "username": "replay_bot"}
+        elif endpoint in ("sendMessage", "sendPhoto", "editMessageText", "editMessageCaption"):
+            result = self._message(parameters, photo=endpoint in ("sendPhoto", "editMessageCaption"))
+        else:
+            result = True
+
+        return 200, dumps({"ok": True, "result": result}).encode()
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_recording(path: str) -> list:
+    records = []
+
+    # файл процесса, который упал, обрывается на недописанном блоке, читаем до него
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    records.append(loads(line))
+    except (EOFError, zlib.error, gzip.BadGzipFile, JSONDecodeError) as error:
+        logger.warning("%s is truncated after %d records: %s", path, len(records), error)
+
+    return records
+
+
+def read_recordings(paths: list) -> list:
+    records = [record for path in paths for record in read_recording(path)]
+    return sorted(records, key=lambda record: record["ts"])
+
+
+def make_engine(records: list, fixtures: dict):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+
+    sessions = set()
+    for record in records:
+        text = record["update"].get("message", {}).get("text", "")
+        if text.startswith("/start "):
+            sessions.add(text.split()[1])
+
+    with Session(engine) as session:
+        for qrcode_id, uuid in enumerate(sorted(sessions), start=1):
+            session.add(QRCode(id=qrcode_id, uuid=uuid))
+
+        for item_id, item in enumerate(fixtures["items"], start=1):
+            session.add(Item(id=item_id, name=item["name"], description=item.get("description", ""), price=item["price"], image=item.get("image")))
+
+        for employee_id in range(1, fixtures.get("employees", 1) + 1):
+            session.add(Employee(id=employee_id, salary=0, order_count=0, user_id=employee_id))
+
+        session.commit()
+
+    return engine
+
+
+def summary(values: list) -> dict:
+    if len(values) < 2:
+        value = values[0] if values else 0
+        return {"mean": value, "p50": value, "p90": value, "p99": value, "max": value}
+
+    percentiles = quantiles(values, n=100, method="inclusive")
+    return {
+        "mean": mean(values),
+        "p50": percentiles[49],
+        "p90": percentiles[89],
+        "p99": percentiles[98],
+        "max": max(values)
+    }
+
+
+async def replay(records: list, fixtures: dict, speed: float) -> dict:
+    engine = make_engine(records=records, fixtures=fixtures)
+
+    queries = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(*args) -> None:
+        queries[0] += 1
+
+    # подменяем базу и папку с qr кодами на локальные
+    commands.engine = engine
+    commands.locations = utils.LocationRegistry(engine=engine, location_model=Location, item_model=Item, qrcode_model=QRCode)
+    commands.cart_storage = None
+    commands.media_cache = utils.MediaCache(engine=engine, media_model=MediaFile, path=tempfile.mkdtemp())
+    utils.QRCODES_PATH = tempfile.mkdtemp()
+
+    request = FakeRequest()
+    app = Application.builder().token("0:replay").request(request).get_updates_request(FakeRequest()).updater(None).build()
+    add_handlers(app, record_updates=False)
+
+    service, latency, update_queries = [], [], []
+
+    async with app:
+        await app.start()
+
+        first_ts = records[0]["ts"] if records else 0
+        started = perf_counter()
+
+        try:
+            for record in records:
+                arrival = started + (record["ts"] - first_ts) / speed if speed else started
+                delay = arrival - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                update = Update.de_json(record["update"], app.bot)
+                queries_before = queries[0]
+                begin = perf_counter()
+
+                await app.process_update(update)
+
+                finish = perf_counter()
+                service.append(finish - begin)
+                latency.append(finish - arrival)
+                update_queries.append(queries[0] - queries_before)
+        finally:
+            await app.stop()
+
+        duration = perf_counter() - started
+
+    return {
+        "updates": len(records),
+        "speed": speed,
+        "duration": duration,
+        "throughput": len(records) / duration if duration else 0,
+        "service": summary(service),
+        "latency": summary(latency),
+        "queries": {"total": queries[0], "per_update": summary(update_queries)},
+        "api_calls": dict(request.calls)
+    }
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> bool:
+    regressed = False
+    metrics = [
+        ("service", key) for key in ("mean", "p50", "p90", "p99")
+    ] + [
+        ("latency", key) for key in ("p50", "p99")
+    ] + [
+        ("queries", "total")
+    ]
+
+    for group, key in metrics:
+        old = baseline[group][key]
+        new = candidate[group][key]
+        # рост с нуля процентами не выразить, любое увеличение считаем регрессией
+        if old:
+            change = (new - old) / old * 100
+        else:
+            change = float("inf") if new > old else 0
+        mark = ""
+
+        if change > threshold:
+            mark = " <- regression"
+            regressed = True
+
+        print(f"{group}.{key}: {old:.6g} -> {new:.6g} ({change:+.1f}%){mark}")
+
+    return regressed
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Replay recorded updates against local stand-ins for the database and Bot API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("recordings", nargs="+", help="recorded updates (.jsonl.gz), one file per bot process")
+    run_parser.add_argument("--fixtures", help="json with items (name, price, optional description and image) and employee count")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="1 for real time, N for N times faster, 0 for max speed")
+    run_parser.add_argument("--output", help="file to write the report to")
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline, 'r') as f:
+            baseline = load(f)
+        with open(args.candidate, 'r') as f:
+            candidate = load(f)
+
+        sys.exit(1 if compare(baseline, candidate, args.threshold) else 0)
+
+    if args.fixtures:
+        with open(args.fixtures, 'r') as f:
+            fixtures = load(f)
+    else:
+        fixtures = {"items": [{"name": f"Item {i}", "price": 100} for i in range(1, 31)], "employees": 3}
+
+    records = read_recordings(args.recordings)
+    report = asyncio.run(replay(records=records, fixtures=fixtures, speed=args.speed))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            dump(report, f, indent=4)
+    else:
+        print(dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
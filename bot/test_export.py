@@ -0,0 +1,112 @@
+import csv
+from io import StringIO
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import export
+from export import OrderExporter, app
+from models import Base, Order, OrderItem, Item
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'orders.db'}")
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        session.add(Item(id=1, name="Tea", description="", price=100))
+
+        for order_id in range(1, 11):
+            session.add(Order(id=order_id, total_price=100, qrcode_id=None, employee_id=1))
+            session.add(OrderItem(id=order_id, order_id=order_id, item_id=1))
+
+        session.commit()
+
+    return engine
+
+
+def test_csv_resume_from_checkpoint(engine, tmp_path, monkeypatch):
+    output = str(tmp_path / "orders.csv")
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    save_checkpoint = export._save_checkpoint
+    saves = []
+
+    def interrupting_save(path, after):
+        save_checkpoint(path, after)
+        saves.append(after)
+        if len(saves) == 2:
+            raise Interrupted
+
+    monkeypatch.setattr(export, "_save_checkpoint", interrupting_save)
+
+    with pytest.raises(Interrupted):
+        export.export(OrderExporter(engine=engine, batch_size=3), output, "csv", checkpoint)
+
+    assert export._load_checkpoint(checkpoint) == 6
+
+    monkeypatch.setattr(export, "_save_checkpoint", save_checkpoint)
+
+    exporter = OrderExporter(engine=engine, batch_size=3, after=export._load_checkpoint(checkpoint))
+    export.export(exporter, output, "csv", checkpoint)
+
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    assert [int(row["order_item_id"]) for row in rows] == list(range(1, 11))
+    assert export._load_checkpoint(checkpoint) == 10
+
+
+def test_columnar_resume_refuses_existing_output(engine, tmp_path):
+    output = tmp_path / "orders.parquet"
+    output.write_bytes(b"")
+
+    with pytest.raises(FileExistsError):
+        export.export(OrderExporter(engine=engine, after=5), str(output), "parquet", None)
+
+
+def test_record_batches_keep_schema_for_null_columns(engine):
+    pytest.importorskip("pyarrow")
+
+    batches = list(OrderExporter(engine=engine, batch_size=3).record_batches())
+
+    assert all(batch.schema == export.SCHEMA for batch in batches)
+
+
+def test_endpoint_rejects_unknown_format(engine, monkeypatch):
+    monkeypatch.setattr(export, "engine", engine)
+    client = TestClient(app)
+
+    assert client.get("/export/orders", params={"file_format": "parquet"}).status_code == 422
+    assert client.get("/export/orders").status_code == 200
+
+
+def test_endpoint_rejects_non_positive_batch_size(engine, monkeypatch):
+    monkeypatch.setattr(export, "engine", engine)
+    client = TestClient(app)
+
+    assert client.get("/export/orders", params={"batch_size": 0}).status_code == 422
+    assert client.get("/export/orders", params={"batch_size": -1}).status_code == 422
+
+
+def test_empty_range_keeps_header_and_schema(engine, tmp_path):
+    exporter = OrderExporter(engine=engine, min_order_id=100)
+    rows = list(csv.reader(StringIO("".join(exporter.csv_chunks()))))
+
+    assert rows == [export.COLUMNS]
+
+    pa = pytest.importorskip("pyarrow")
+
+    stream = b"".join(OrderExporter(engine=engine, min_order_id=100).arrow_chunks())
+    assert pa.ipc.open_stream(stream).read_all().schema == export.SCHEMA
+
+    output = str(tmp_path / "orders.arrow")
+    export.export(OrderExporter(engine=engine, min_order_id=100), output, "arrow", None)
+    assert pa.ipc.open_file(output).read_all().num_rows == 0
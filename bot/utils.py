@@ -1,17 +1,48 @@
+from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, Query
-from telegram import ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy.engine import Engine
+from telegram import Bot, Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
 import qrcode
 from uuid import uuid4
 from math import ceil
-from typing import Tuple
+from time import monotonic, time
+from json import load, dump, dumps
+from hashlib import sha256
+import hmac
+import gzip
+from collections import OrderedDict
+from sys import getsizeof
+import os
+from io import BytesIO
+from PIL import Image
+import asyncio
+from typing import Tuple, Callable
+from enum import Enum
+
+
+QRCODES_PATH = ".../rc-project-main/web/static/qrcodes" # здесь путь до папки с qr кодами
+
+BUTTONS = {
+    "language": {"eng": "English", "rus": "Русский"},
+    "items": {"eng": "Items to buy", "rus": "Предметы для покупки"},
+    "order": {"eng": "Current order", "rus": "Текущий заказ"},
+    "menu": {"eng": "Back to menu", "rus": "Обратно в меню"},
+    "prev": {"eng": "<", "rus": "<"},
+    "next": {"eng": ">", "rus": ">"},
+    "exit": {"eng": "Exit", "rus": "Выход"},
+    "checkout": {"eng": "Checkout", "rus": "Оплатить"}
+}
+
+
+def button(action: str, language: str) -> str:
+    return BUTTONS[action][language]
 
 
 class ItemPaginator:
-    def __init__(self, engine, item_model, language: str) -> None:
-        self._engine = engine
-        self._item_model = item_model
+    def __init__(self, catalog, language: str) -> None:
         self._items_on_page: int = 9
-        self._items: list = self._get_items()
+        self._catalog = catalog
         self._current_page: int = 1
         self._pages: int = self._count_pages()
         self._language: str = language
@@ -32,13 +63,8 @@ class ItemPaginator:
     def pages(self) -> int:
         return self._pages
     
-    def _get_items(self) -> list:
-        with Session(self._engine) as session:
-            query = session.query(self._item_model)
-            return query.all()    
-
     def _count_pages(self) -> int:
-        items_count = len(self._items)
+        items_count = len(self._catalog.items)
         pages = ceil(items_count / self._items_on_page)
         return pages
     
@@ -47,7 +73,7 @@ class ItemPaginator:
         return min_range
     
     def _get_max_page_range(self) -> int:
-        max_index = len(self._items)
+        max_index = len(self._catalog.items)
         max_range = self._current_page * self._items_on_page
         
         if max_range > max_index:
@@ -56,14 +82,11 @@ class ItemPaginator:
         return max_range
 
     def _add_buttons(self) -> list:
-        buttons = ["<", "", ">"]
-        
-        if self._language == "rus":
-            buttons[1] = "Обратно в меню"
-        elif self._language == "eng":
-            buttons[1] = "Back to menu"
-            
-        return buttons
+        return [
+            button("prev", self._language),
+            button("menu", self._language),
+            button("next", self._language)
+        ]
  
     def page(self) -> ReplyKeyboardMarkup:
         keyboard = [[]]
@@ -73,7 +96,7 @@ class ItemPaginator:
         
         x, y = 0, 0
         
-        for item in self._items[min_range:max_range]:
+        for item in self._catalog.items[min_range:max_range]:
             if x > 2:
                 x = 0
                 y += 1
@@ -95,9 +118,9 @@ class ItemPaginator:
         return text
     
     def do_action(self, action: str) -> None:
-        if action == ">" and self._current_page != self._pages:
+        if action == button("next", self._language) and self._current_page != self._pages:
             self.next()
-        elif action == "<" and self._current_page != 1:
+        elif action == button("prev", self._language) and self._current_page != 1:
             self.prev()
 
     def next(self) -> None:
@@ -118,40 +141,27 @@ class ReplyGenerator:
     @staticmethod
     def start_reply() -> Tuple[str, ReplyKeyboardMarkup]:
         text = "Hello! Select language to continue."
-        keyboard = [["English", "Русский"]]
+        keyboard = [[button("language", "eng"), button("language", "rus")]]
         
         return (text, ReplyKeyboardMarkup(keyboard=keyboard))
     
     def menu_reply(self, condition) -> Tuple[str, ReplyKeyboardMarkup]:
         if self.language == "rus":
             text = "Выберите следующее действие чтобы продолжить."
-            
-            if not condition:
-                keyboard = [
-                    ["Предметы для покупки"],
-                    ["Выход"]
-                ]
-            else:
-                keyboard = [
-                    ["Предметы для покупки"],
-                    ["Текущий заказ"],
-                    ["Оплатить"]
-                ]
-            
         elif self.language == "eng":
             text = "Choose next action to proceed."
         
-            if not condition:
-                keyboard = [
-                    ["Items to buy"],
-                    ["Exit"]
-                ]
-            else:
-                keyboard = [
-                    ["Items to buy"],
-                    ["Current order"],
-                    ["Checkout"]
-                ]
+        if not condition:
+            keyboard = [
+                [button("items", self.language)],
+                [button("exit", self.language)]
+            ]
+        else:
+            keyboard = [
+                [button("items", self.language)],
+                [button("order", self.language)],
+                [button("checkout", self.language)]
+            ]
         
         return (text, ReplyKeyboardMarkup(keyboard=keyboard))
     
@@ -194,16 +204,13 @@ class ReplyGenerator:
     def order_reply(self, total_price: int) -> Tuple[str, ReplyKeyboardMarkup]:
         if self.language == "rus":
             text = f"Общая стоимость: {total_price}"
-            keyboard = [
-                ["Предметы для покупки"],
-                ["Оплатить"]
-            ]
         elif self.language == "eng":
             text = f"Total price: {total_price}"
-            keyboard = [
-                ["Items to buy"],
-                ["Checkout"]
-            ]
+        
+        keyboard = [
+            [button("items", self.language)],
+            [button("checkout", self.language)]
+        ]
 
         return (text, ReplyKeyboardMarkup(keyboard=keyboard))
     
@@ -211,17 +218,14 @@ class ReplyGenerator:
         if self.language == "rus":
             query_text = f"Успешно удален(а) {item_name} из заказа."
             text = f"Общая стоимость: {total_price}"
-            keyboard = [
-                ["Предметы для покупки"],
-                ["Оплатить"]
-            ]
         elif self.language == "eng":
             query_text = f"Succesfully deleted {item_name} from order."
             text = f"Total price: {total_price}"
-            keyboard = [
-                ["Items to buy"],
-                ["Checkout"]
-            ]
+        
+        keyboard = [
+            [button("items", self.language)],
+            [button("checkout", self.language)]
+        ]
 
         return (query_text, text, ReplyKeyboardMarkup(keyboard=keyboard))
     
@@ -279,7 +283,8 @@ class SyncOrder:
                  employee_model,
                  total_price: int,
                  qrcode_id: int,
-                 current_order: list
+                 current_order: list,
+                 location_id: int | None = None
     ) -> None:
         self._engine = engine
         self._order_model = order_model
@@ -288,6 +293,7 @@ class SyncOrder:
         self._total_price = total_price
         self._qrcode_id = qrcode_id
         self._current_order = current_order
+        self._location_id = location_id
         
         self._order = self._make_order()
         self._order_items = self._make_order_items()
@@ -310,9 +316,13 @@ class SyncOrder:
         
     def _get_employee_id(self) -> int:
         getter = ItemGetter(engine=self._engine, item_model=self._employee_model)
-        query = getter._query
-        query = query.order_by(self._employee_model.order_count).first()
-        return query.id
+        query = getter._query.filter(self._employee_model.location_id == self._location_id)
+        employee = query.order_by(self._employee_model.order_count).first()
+        
+        if not employee:
+            raise LookupError(f"No employees for location {self._location_id}.")
+        
+        return employee.id
     
     def _increment_employee_orders(self, employee_id) -> None:
         with Session(self._engine) as session:
@@ -357,13 +367,13 @@ class QRCodeGenerator:
         self._bot_username: str = bot_username
     
     def _get_uuid(self) -> str:
-        return uuid4()
+        return str(uuid4())
     
     def make_qrcode(self) -> None:
         link = f"https://t.me/{self._bot_username}?start={self._uuid}"
         
         img = qrcode.make(link)
-        img.save(f".../rc-project-main/web/static/qrcodes/{self._qrcode_id}.png") # здесьЫ путь до папки с qr кодами
+        img.save(f"{QRCODES_PATH}/{self._qrcode_id}.png")
 
     def sync_with_db(self) -> None:
         with Session(self._engine) as session:
@@ -373,12 +383,367 @@ class QRCodeGenerator:
             session.commit()
 
 
+LANGUAGES = {text: language for language, text in BUTTONS["language"].items()}
+
+
 def language_converter(text: str) -> str | None:
-    if text == "Русский":
-        language = "rus"
-    elif text == "English":
-        language = "eng"
+    return LANGUAGES.get(text)
+
+
+class TextRouter:
+    def __init__(self, states: dict, defaults: dict | None = None) -> None:
+        self._states = states
+        self._defaults = defaults or {}
+        self._tables: dict = {state: self._make_table(actions) for state, actions in states.items()}
+
+    @staticmethod
+    def _make_table(actions: dict) -> dict:
+        table = {}
+        
+        for action in actions:
+            for language, text in BUTTONS[action].items():
+                table[text] = (action, language)
+        
+        return table
+
+    def route(self, state: int, text: str) -> Tuple[str, str] | None:
+        return self._tables[state].get(text)
+
+    def handler(self, state: int) -> Callable:
+        actions = self._states[state]
+        default = self._defaults.get(state)
+
+        async def callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> int | None:
+            route = self.route(state=state, text=update.message.text)
+            
+            if route:
+                action, language = route
+                if action == "language":
+                    ctx.user_data["language"] = language
+                
+                return await actions[action](update, ctx)
+            if default:
+                return await default(update, ctx)
+            
+            return None
+        
+        return callback
+
+
+class ConversationTracker:
+    def __init__(self, max_conversations: int) -> None:
+        self._max_conversations = max_conversations
+        self._activity: OrderedDict = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._activity)
+    
+    def touch(self, user_id: int) -> list:
+        self._activity[user_id] = monotonic()
+        self._activity.move_to_end(user_id)
+        
+        evicted = []
+        
+        while len(self._activity) > self._max_conversations:
+            evicted_id, _ = self._activity.popitem(last=False)
+            evicted.append(evicted_id)
+        
+        return evicted
+    
+    def forget(self, user_id: int) -> None:
+        self._activity.pop(user_id, None)
+    
+    def idle(self, user_id: int) -> float | None:
+        last_activity = self._activity.get(user_id)
+        
+        if last_activity is None:
+            return None
+        
+        return monotonic() - last_activity
+
+
+class CartStorage:
+    def __init__(self, path: str) -> None:
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+    
+    def _file(self, user_id: int) -> str:
+        return os.path.join(self._path, f"{user_id}.json")
+    
+    def save(self, user_id: int, cart: dict) -> None:
+        with open(self._file(user_id), 'w') as f:
+            dump(cart, f)
+    
+    def load(self, user_id: int) -> dict | None:
+        try:
+            with open(self._file(user_id), 'r') as f:
+                cart = load(f)
+        except FileNotFoundError:
+            return None
+        
+        self.delete(user_id)
+        return cart
+    
+    def delete(self, user_id: int) -> None:
+        try:
+            os.remove(self._file(user_id))
+        except FileNotFoundError:
+            pass
+
+
+def deep_sizeof(obj, seen: set | None = None) -> int:
+    if seen is None:
+        seen = set()
+    
+    # движок, каталоги, бот и константы-перечисления общие для всех разговоров, их не считаем
+    if id(obj) in seen or isinstance(obj, (Engine, Catalog, Bot, Enum, type)):
+        return 0
+    
+    seen.add(id(obj))
+    size = getsizeof(obj)
+    
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(value, seen) for value in obj)
     else:
-        language = None
-     
-    return language
\ No newline at end of file
+        attributes = dict(vars(obj)) if hasattr(obj, "__dict__") else {}
+
+        # объекты telegram хранят поля в __slots__, а не в __dict__
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            for slot in (slots,) if isinstance(slots, str) else slots:
+                if slot not in ("__dict__", "__weakref__") and hasattr(obj, slot):
+                    attributes[slot] = getattr(obj, slot)
+
+        size += sum(
+            deep_sizeof(value, seen) for key, value in attributes.items() if not key.startswith("_sa_")
+        )
+    
+    return size
+
+
+class UpdateRecorder:
+    _private_keys = {"last_name", "username", "phone_number", "title", "bio"}
+    _identity_keys = {"from", "chat", "user", "sender_chat"}
+    
+    def __init__(self, path: str, salt: str, flush_every: int = 100) -> None:
+        # каждый процесс пишет свой файл, чтобы недописанный после падения gzip не портил следующие записи
+        base = path[:-len(".jsonl.gz")] if path.endswith(".jsonl.gz") else path
+        self.path = f"{base}-{int(time())}-{os.getpid()}.jsonl.gz"
+        
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._salt: bytes = salt.encode()
+        self._flush_every = flush_every
+        self._pending: int = 0
+    
+    def _digest(self, value) -> str:
+        return hmac.new(self._salt, str(value).encode(), sha256).hexdigest()
+    
+    def _pseudo_id(self, value: int) -> int:
+        return int(self._digest(value)[:12], 16)
+    
+    def _session(self, session_id: str) -> str:
+        return f"replay-{self._digest(session_id)[:12]}"
+    
+    def _anonymize(self, data, parent: str | None = None):
+        if isinstance(data, list):
+            return [self._anonymize(value, parent) for value in data]
+        
+        if not isinstance(data, dict):
+            return data
+        
+        result = {}
+        
+        for key, value in data.items():
+            if key == "first_name":
+                result[key] = "anonymous"
+            elif key in self._private_keys:
+                continue
+            elif key == "id" and parent in self._identity_keys:
+                result[key] = self._pseudo_id(value)
+            elif key == "text" and isinstance(value, str) and value.startswith("/start "):
+                result[key] = f"/start {self._session(value.split()[1])}"
+            else:
+                result[key] = self._anonymize(value, key)
+        
+        return result
+    
+    def record(self, update: dict) -> None:
+        line = dumps({"ts": time(), "update": self._anonymize(update)}, ensure_ascii=False)
+        self._file.write(line + "\n")
+        
+        self._pending += 1
+        if self._pending >= self._flush_every:
+            self._file.flush()
+            self._pending = 0
+    
+    def close(self) -> None:
+        self._file.close()
+
+
+class MediaCache:
+    def __init__(self, engine, media_model, path: str, thumbnail_size: Tuple[int, int] = (1024, 1024)) -> None:
+        self._engine = engine
+        self._media_model = media_model
+        self._path = path
+        self._thumbnail_size = thumbnail_size
+        self._hashes: dict = {}
+        self._file_ids: dict = {}
+    
+    def _hash_file(self, image: str) -> str:
+        content_hash = sha256()
+        
+        with open(image, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                content_hash.update(chunk)
+        
+        return content_hash.hexdigest()
+    
+    async def content_hash(self, image: str) -> str:
+        stat = os.stat(image)
+        key = (image, stat.st_mtime_ns, stat.st_size)
+        
+        if key not in self._hashes:
+            self._hashes[key] = await asyncio.to_thread(self._hash_file, image)
+        
+        return self._hashes[key]
+    
+    def _make_thumbnail(self, image: str, content_hash: str) -> bytes:
+        thumbnail_file = os.path.join(self._path, f"{content_hash}.jpg")
+        
+        if os.path.exists(thumbnail_file):
+            with open(thumbnail_file, 'rb') as f:
+                return f.read()
+        
+        with Image.open(image) as img:
+            img = img.convert("RGB")
+            img.thumbnail(self._thumbnail_size)
+            
+            buffer = BytesIO()
+            img.save(buffer, format="JPEG", quality=85, optimize=True)
+        
+        os.makedirs(self._path, exist_ok=True)
+        with open(thumbnail_file, 'wb') as f:
+            f.write(buffer.getvalue())
+        
+        return buffer.getvalue()
+    
+    async def thumbnail(self, image: str) -> bytes:
+        content_hash = await self.content_hash(image)
+        return await asyncio.to_thread(self._make_thumbnail, image, content_hash)
+    
+    def get_file_id(self, content_hash: str) -> str | None:
+        if content_hash not in self._file_ids:
+            getter = ItemGetter(engine=self._engine, item_model=self._media_model)
+            media = getter.get_item(attribute="content_hash", value=content_hash)
+            
+            if not media:
+                return None
+            
+            self._file_ids[content_hash] = media.file_id
+        
+        return self._file_ids[content_hash]
+    
+    def save_file_id(self, content_hash: str, file_id: str) -> None:
+        self._file_ids[content_hash] = file_id
+        
+        with Session(self._engine) as session:
+            session.merge(self._media_model(content_hash=content_hash, file_id=file_id))
+            session.commit()
+    
+    def forget(self, content_hash: str) -> None:
+        self._file_ids.pop(content_hash, None)
+        
+        with Session(self._engine) as session:
+            session.query(self._media_model).filter(self._media_model.content_hash == content_hash).delete()
+            session.commit()
+
+
+class Catalog:
+    def __init__(self, items: list) -> None:
+        self.items = items
+        self.loaded_at: float = monotonic()
+        self._by_id: dict = {item.id: item for item in items}
+        self._by_name: dict = {item.name: item for item in items}
+    
+    def get_item(self, attribute: str, value):
+        if attribute == "id":
+            return self._by_id.get(int(value))
+        elif attribute == "name":
+            return self._by_name.get(value)
+        
+        raise KeyError(f"Catalog has no index for {attribute}.")
+
+
+class LocationRegistry:
+    def __init__(self, engine, location_model, item_model, qrcode_model, catalog_ttl: float = 60) -> None:
+        self._engine = engine
+        self._location_model = location_model
+        self._item_model = item_model
+        self._qrcode_model = qrcode_model
+        self._catalog_ttl = catalog_ttl
+        self._engines: dict = {}
+        self._catalogs: dict = {}
+        self._copied_qrcodes: set = set()
+    
+    def engine(self, location_id: int | None):
+        if location_id is None:
+            return self._engine
+        
+        if location_id not in self._engines:
+            getter = ItemGetter(engine=self._engine, item_model=self._location_model)
+            location = getter.get_item(attribute="id", value=location_id)
+            
+            if location and location.db_token:
+                self._engines[location_id] = create_engine(location.db_token)
+            else:
+                self._engines[location_id] = self._engine
+        
+        return self._engines[location_id]
+    
+    def _get_items(self, location_id: int | None) -> list:
+        with Session(self.engine(location_id)) as session:
+            # без локации показываем только товары без локации, а не все кафе сразу
+            query = session.query(self._item_model).filter(self._item_model.location_id == location_id)
+            
+            return query.order_by(self._item_model.id).all()
+    
+    def catalog(self, location_id: int | None) -> Catalog:
+        catalog = self._catalogs.get(location_id)
+        
+        if not catalog or monotonic() - catalog.loaded_at > self._catalog_ttl:
+            catalog = Catalog(items=self._get_items(location_id))
+            self._catalogs[location_id] = catalog
+        
+        return catalog
+    
+    def location_ids(self) -> list:
+        getter = ItemGetter(engine=self._engine, item_model=self._location_model)
+        return [location.id for location in getter.get_query_list()]
+    
+    def copy_qrcode(self, location_id: int | None, qrcode_id: int) -> None:
+        engine = self.engine(location_id)
+        
+        # заказ ссылается на qr код, поэтому в отдельной БД локации нужна его копия
+        if engine is self._engine or (location_id, qrcode_id) in self._copied_qrcodes:
+            return
+        
+        location = ItemGetter(engine=self._engine, item_model=self._location_model).get_item(attribute="id", value=location_id)
+        qrcode = ItemGetter(engine=self._engine, item_model=self._qrcode_model).get_item(attribute="id", value=qrcode_id)
+        
+        with Session(engine) as session:
+            session.merge(self._location_model(id=location.id, name=location.name))
+            session.merge(self._qrcode_model(id=qrcode.id, uuid=qrcode.uuid, location_id=qrcode.location_id))
+            session.commit()
+        
+        self._copied_qrcodes.add((location_id, qrcode_id))
+    
+    def refresh(self) -> None:
+        for engine in self._engines.values():
+            if engine is not self._engine:
+                engine.dispose()
+        
+        self._engines.clear()
+        self._catalogs.clear()
+        self._copied_qrcodes.clear()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import re
+import asyncio
+from time import perf_counter
+from argparse import ArgumentParser
+
+import httpx
+
+
+ASSET_PATTERN = re.compile(r'(?:href|src)="([^"]+)"')
+
+
+class Screen:
+    def __init__(self, client: httpx.AsyncClient, qrcode_id: int) -> None:
+        self._client = client
+        self._qrcode_id = qrcode_id
+        self._etags: dict = {}
+        self._immutable: set = set()
+        self._assets: list = []
+        self.requests: int = 0
+        self.bytes: int = 0
+
+    async def _get(self, url: str) -> httpx.Response | None:
+        if url in self._immutable:
+            return None
+
+        headers = {}
+        if url in self._etags:
+            headers["if-none-match"] = self._etags[url]
+
+        response = await self._client.get(url, headers=headers)
+
+        self.requests += 1
+        self.bytes += response.num_bytes_downloaded
+
+        if "etag" in response.headers:
+            self._etags[url] = response.headers["etag"]
+        if "immutable" in response.headers.get("cache-control", ""):
+            self._immutable.add(url)
+
+        return response
+
+    async def reload(self) -> None:
+        response = await self._get(f"/qrcode/{self._qrcode_id}")
+
+        if response.status_code == 200:
+            self._assets = ASSET_PATTERN.findall(response.text)
+
+        for asset in self._assets:
+            await self._get(asset)
+
+
+async def load_test(url: str, screens: int, duration: float, interval: float) -> dict:
+    limits = httpx.Limits(max_connections=screens)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, headers={"accept-encoding": "br, gzip"}) as client:
+        tables = [Screen(client=client, qrcode_id=qrcode_id) for qrcode_id in range(1, screens + 1)]
+        started = perf_counter()
+
+        async def run_screen(screen: Screen) -> None:
+            while perf_counter() - started < duration:
+                await screen.reload()
+                await asyncio.sleep(interval)
+
+        await asyncio.gather(*(run_screen(screen) for screen in tables))
+        elapsed = perf_counter() - started
+
+    requests = sum(screen.requests for screen in tables)
+    sent = sum(screen.bytes for screen in tables)
+
+    return {
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "bytes_per_minute": sent / elapsed * 60
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Emulate table screens reloading the QR page.")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8000")
+    parser.add_argument("--screens", type=int, default=50, help="number of table screens")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between reloads, 0 for max rate")
+    args = parser.parse_args()
+
+    result = asyncio.run(load_test(url=args.url, screens=args.screens, duration=args.duration, interval=args.interval))
+
+    print(f"Requests: {result['requests']}")
+    print(f"Requests/sec: {result['requests_per_second']:.1f}")
+    print(f"Bytes served per minute: {result['bytes_per_minute']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,211 @@
+import os
+import gzip
+from collections import OrderedDict
+from hashlib import sha256
+from mimetypes import guess_type
+from urllib.parse import parse_qs
+
+from anyio import to_thread
 from uvicorn import run
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_PATH = "static"
+COMPRESSIBLE = (".css", ".js", ".html", ".svg")
+MAX_PAGES = 1000
+
+
+def accepted_encodings(header: str) -> dict:
+    encodings = {}
+
+    for part in header.split(","):
+        coding, *params = [value.strip() for value in part.split(";")]
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        encodings[coding.lower()] = quality
+
+    return encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    encodings = (("br", ".br"), ("gzip", ".gz"))
+
+    async def _compressed_response(self, path: str, scope) -> Response | None:
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+
+        # q=0 означает, что клиент это сжатие не принимает
+        qualities = {encoding: accepted.get(encoding, accepted.get("*", 0)) for encoding, _ in self.encodings}
+        encodings = sorted(self.encodings, key=lambda pair: -qualities[pair[0]])
+
+        for encoding, suffix in encodings:
+            if qualities[encoding] <= 0:
+                continue
+
+            full_path, stat_result = await to_thread.run_sync(self.lookup_path, path + suffix)
+            if not stat_result:
+                continue
+
+            response = self.file_response(full_path, stat_result, scope)
+            response.headers["content-encoding"] = encoding
+            response.headers["content-type"] = guess_type(path)[0] or "application/octet-stream"
+            return response
+
+        return None
+
+    async def get_response(self, path: str, scope) -> Response:
+        # сжатые копии отдаются только через content-encoding, напрямую их не раздаём
+        if path.endswith(tuple(suffix for _, suffix in self.encodings)):
+            raise HTTPException(status_code=404)
+
+        response = await self._compressed_response(path, scope)
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["vary"] = "Accept-Encoding"
+
+        # навсегда кэшируется только адрес с актуальным отпечатком содержимого
+        version = parse_qs(scope.get("query_string", b"").decode()).get("v", [None])[0]
+
+        if version and version == await to_thread.run_sync(fingerprint, path):
+            response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["cache-control"] = "no-cache"
+
+        return response
+
+
+def precompress(directory: str) -> None:
+    compressors = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        compressors.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+
+            path = os.path.join(root, name)
+
+            with open(path, 'rb') as f:
+                content = f.read()
 
+            for suffix, compress in compressors:
+                compressed_path = path + suffix
+
+                if os.path.exists(compressed_path) and os.path.getmtime(compressed_path) >= os.path.getmtime(path):
+                    continue
+
+                with open(compressed_path, 'wb') as f:
+                    f.write(compress(content))
+
+
+# путь -> (mtime, размер, отпечаток)
+_fingerprints: dict = {}
+
+
+def fingerprint(path: str) -> str | None:
+    full_path = os.path.join(STATIC_PATH, path)
+
+    try:
+        stat = os.stat(full_path)
+    except FileNotFoundError:
+        return None
+
+    cached = _fingerprints.get(full_path)
+
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(full_path, 'rb') as f:
+        version = sha256(f.read()).hexdigest()[:16]
+
+    _fingerprints[full_path] = (stat.st_mtime_ns, stat.st_size, version)
+
+    return version
+
+
+def static_url(path: str) -> str:
+    version = fingerprint(path)
+
+    if version is None:
+        return f"/static/{path}"
+
+    return f"/static/{path}?v={version}"
+
+
+precompress(STATIC_PATH)
 
 app = FastAPI()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_PATH), name="static")
 
 templates = Jinja2Templates(directory="templates")
 
+# qrcode_id -> (версия qr кода, etag, html), давно не запрошенные страницы вытесняются
+_pages: OrderedDict = OrderedDict()
+
+
+def render_qrcode(qrcode_id: int) -> tuple:
+    path = f"qrcodes/{qrcode_id}.png"
+    version = (fingerprint(path), fingerprint("styles.css"))
+
+    cached = _pages.get(qrcode_id)
+    if cached and cached[0] == version:
+        _pages.move_to_end(qrcode_id)
+        return cached[1], cached[2]
+
+    html = templates.get_template("qrcode.html").render(
+        qrcode_id=qrcode_id,
+        styles_url=static_url("styles.css"),
+        qrcode_url=static_url(path)
+    ).encode()
+
+    etag = f'"{sha256(html).hexdigest()[:16]}"'
 
-@app.get("/qrcode/{id}", response_class=HTMLResponse)
+    # страницы для несуществующих qr кодов не кэшируем, иначе перебор id раздувает память
+    if None not in version:
+        _pages[qrcode_id] = (version, etag, html)
+        _pages.move_to_end(qrcode_id)
+
+        if len(_pages) > MAX_PAGES:
+            _pages.popitem(last=False)
+    else:
+        _pages.pop(qrcode_id, None)
+
+    return etag, html
+
+
+@app.get("/qrcode/{id}")
 async def show_qrcode(request: Request, id: int):
-    path = f"qrcodes/{id}.png"
-    return templates.TemplateResponse("qrcode.html", {"request": request, "qrcode_id": id, "path": path})
+    etag, html = await to_thread.run_sync(render_qrcode, id)
+
+    headers = {"etag": etag, "cache-control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=html, media_type="text/html", headers=headers)
 
 if __name__ == '__main__':
-    run('main:app', reload=True, log_level="info")
\ No newline at end of file
+    run('main:app', reload=True, log_level="info")